@@ -91,6 +91,13 @@ class HTTPService(BaseService):
             result = collect_all_statistics()
             return result
 
+        @app.on_event("shutdown")
+        async def _close_client_session():
+            """Release the HTTP connections kept alive by the megaservice orchestrator."""
+            from .orchestrator import close_shared_session
+
+            await close_shared_session()
+
         return app
 
     def add_startup_event(self, func):
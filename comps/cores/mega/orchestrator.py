@@ -4,15 +4,17 @@
 import asyncio
 import contextlib
 import copy
-import json
+import functools
 import os
 import re
+import sys
 import threading
 import time
+from collections import OrderedDict
 from typing import Dict, List
 
 import aiohttp
-import requests
+import orjson
 from fastapi.responses import StreamingResponse
 from prometheus_client import Gauge, Histogram
 from pydantic import BaseModel
@@ -26,9 +28,43 @@ from .logger import CustomLogger
 logger = CustomLogger("comps-core-orchestrator")
 LOGFLAG = os.getenv("LOGFLAG", False)
 ENABLE_OPEA_TELEMETRY = bool(os.environ.get("TELEMETRY_ENDPOINT"))
+# max number of streamed sentences being post-processed by the downstream service at once
+STREAM_POST_PROCESS_CONCURRENCY = 8
+# number of inter-token latencies collected before they are recorded in the histogram
+TOKEN_METRICS_BATCH_SIZE = 32
+# one streamed token: a word with at most one surrounding whitespace on each side
+_TOKEN_RE = re.compile(r"\s?\S+\s?")
+# punctuation closing a sentence, which is then sent to the downstream post-processing service
+_SENTENCE_ENDS = (".", "?", "!", "。", "，", "！")
+# request bodies may have non-str keys, e.g. token ids in logit_bias, which json.dumps turned into strings
+_JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+_STREAM_DONE = b"[DONE]\n\n"
+# SSE frames sent to the client, pre-encoded so that no str is encoded per streamed token
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+_SSE_DONE = _SSE_PREFIX + _STREAM_DONE
+# framing of a streamed chunk, i.e. "data: b'...'\n\n", with either quote style
+_CHUNK_PREFIXES = ("data: b'", 'data: b"')
+_CHUNK_SUFFIXES = ("'\n\n", '"\n\n')
+_CHUNK_PREFIX_LEN = len(_CHUNK_PREFIXES[0])
+_CHUNK_SUFFIX_LEN = len(_CHUNK_SUFFIXES[0])
 
 
 class OrchestratorMetrics:
+    __slots__ = (
+        "_lock",
+        "first_token_latency",
+        "inter_token_latency",
+        "request_latency",
+        "request_pending",
+        "_observe_first_token",
+        "_observe_inter_token",
+        "token_update",
+        "inter_token_update",
+        "request_update",
+        "pending_update",
+    )
+
     def __init__(self) -> None:
         # locking for latency metric creation / method change
         self._lock = threading.Lock()
@@ -39,25 +75,41 @@ class OrchestratorMetrics:
         self.inter_token_latency = None
         self.request_latency = None
         self.request_pending = None
+        # bound Histogram.observe methods, to skip the attribute lookups on every token
+        self._observe_first_token = None
+        self._observe_inter_token = None
 
         # initial methods to create the metrics
         self.token_update = self._token_update_create
+        self.inter_token_update = self._inter_token_update_create
         self.request_update = self._request_update_create
         self.pending_update = self._pending_update_create
 
+    def _create_token_metrics(self) -> None:
+        # caller holds the lock
+        if self.first_token_latency is None:
+            self.first_token_latency = Histogram("megaservice_first_token_latency", "First token latency (histogram)")
+            self.inter_token_latency = Histogram("megaservice_inter_token_latency", "Inter-token latency (histogram)")
+            self._observe_first_token = self.first_token_latency.observe
+            self._observe_inter_token = self.inter_token_latency.observe
+        # Histogram.observe() is thread-safe, so the lock is not needed past this point
+        self.token_update = self._token_update_real
+        self.inter_token_update = self._inter_token_update_real
+
     def _token_update_create(self, token_start: float, is_first: bool) -> float:
         with self._lock:
             # in case another thread already got here
             if self.token_update == self._token_update_create:
-                self.first_token_latency = Histogram(
-                    "megaservice_first_token_latency", "First token latency (histogram)"
-                )
-                self.inter_token_latency = Histogram(
-                    "megaservice_inter_token_latency", "Inter-token latency (histogram)"
-                )
-                self.token_update = self._token_update_real
+                self._create_token_metrics()
         return self.token_update(token_start, is_first)
 
+    def _inter_token_update_create(self, latencies: List[float]) -> None:
+        with self._lock:
+            # in case another thread already got here
+            if self.inter_token_update == self._inter_token_update_create:
+                self._create_token_metrics()
+        self.inter_token_update(latencies)
+
     def _request_update_create(self, req_start: float) -> None:
         with self._lock:
             # in case another thread already got here
@@ -81,11 +133,16 @@ class OrchestratorMetrics:
     def _token_update_real(self, token_start: float, is_first: bool) -> float:
         now = time.monotonic()
         if is_first:
-            self.first_token_latency.observe(now - token_start)
+            self._observe_first_token(now - token_start)
         else:
-            self.inter_token_latency.observe(now - token_start)
+            self._observe_inter_token(now - token_start)
         return now
 
+    def _inter_token_update_real(self, latencies: List[float]) -> None:
+        observe = self._observe_inter_token
+        for latency in latencies:
+            observe(latency)
+
     def _request_update_real(self, req_start: float) -> None:
         self.request_latency.observe(time.monotonic() - req_start)
 
@@ -99,13 +156,88 @@ class OrchestratorMetrics:
 # Prometheus metrics need to be singletons, not per Orchestrator
 _metrics = OrchestratorMetrics()
 
+# caps on the connections the megaservice keeps open to the micro services, 0 means unlimited.
+# A streaming reply holds its connection until generation ends, so a per host cap also bounds
+# the number of concurrent streams to one LLM endpoint, later requests wait for a free connection
+CONNECTION_LIMIT = int(os.getenv("MEGASERVICE_CONNECTION_LIMIT", 0))
+CONNECTION_LIMIT_PER_HOST = int(os.getenv("MEGASERVICE_CONNECTION_LIMIT_PER_HOST", 0))
+
+# HTTP client sessions shared by all orchestrators, one per event loop, so that
+# connections to the micro services are kept alive and reused across requests
+_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+
+def get_shared_session() -> aiohttp.ClientSession:
+    """Return the shared aiohttp session of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        # forget the sessions of event loops that are gone, close_shared_session can no longer reach them
+        for stale_loop in [stale_loop for stale_loop in _sessions if stale_loop.is_closed()]:
+            del _sessions[stale_loop]
+        connector = aiohttp.TCPConnector(
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+        )
+        session = aiohttp.ClientSession(connector=connector, trust_env=False, timeout=aiohttp.ClientTimeout(total=2000))
+        _sessions[loop] = session
+    return session
+
+
+async def close_shared_session() -> None:
+    """Close the shared aiohttp sessions of all event loops that are still open."""
+    loop = asyncio.get_running_loop()
+    for session_loop, session in list(_sessions.items()):
+        del _sessions[session_loop]
+        if session.closed or session_loop.is_closed():
+            continue
+        if session_loop is loop:
+            await session.close()
+        elif session_loop.is_running():
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(session.close(), session_loop))
+
+
+@functools.lru_cache(maxsize=256)
+def _black_list_matcher(pattern: str):
+    """Return a predicate telling whether a node name matches the downstream black list pattern."""
+    if re.escape(pattern) == pattern:
+        # no regex metacharacters, a plain substring test is enough
+        return lambda node: pattern in node
+    return re.compile(pattern).search
+
+
+async def _iter_http_chunks(response: aiohttp.ClientResponse):
+    """Yield the response body one HTTP chunk at a time, so that streamed messages are not merged."""
+    if "chunked" not in response.headers.get(aiohttp.hdrs.TRANSFER_ENCODING, "").lower():
+        async for data in response.content.iter_any():
+            yield data
+        return
+
+    buffer = b""
+    async for data, end_of_http_chunk in response.content.iter_chunks():
+        buffer += data
+        if end_of_http_chunk:
+            yield buffer
+            buffer = b""
+    if buffer:
+        yield buffer
+
 
 class ServiceOrchestrator(DAG):
     """Manage 1 or N micro services in a DAG through Python API."""
 
-    def __init__(self) -> None:
+    def __init__(self, result_cache_size: int = 0) -> None:
+        """Initialize the ServiceOrchestrator.
+
+        :param result_cache_size: max number of non-streaming micro service replies memoized across requests,
+            keyed by node and request body. Disabled by default, enable it only for deterministic services.
+        """
         self.metrics = _metrics
         self.services = {}  # all services, id -> service
+        self.result_cache_size = result_cache_size
+        self._result_cache = OrderedDict()  # (node, request body) -> reply, in LRU order
         super().__init__()
 
     def add(self, service):
@@ -131,62 +263,62 @@ class ServiceOrchestrator(DAG):
 
         result_dict = {}
         runtime_graph = DAG()
-        runtime_graph.graph = copy.deepcopy(self.graph)
+        # nodes are plain names, so copying the edge sets is enough to isolate the runtime graph
+        runtime_graph.graph = OrderedDict((node, set(edges)) for node, edges in self.graph.items())
+        # predecessors of every node, kept in sync with the edges removed while running
+        predecessors = {node: [] for node in runtime_graph.graph}
+        for node, edges in runtime_graph.graph.items():
+            for d_node in edges:
+                predecessors[d_node].append(node)
         if LOGFLAG:
             logger.info(initial_inputs)
 
-        timeout = aiohttp.ClientTimeout(total=2000)
-        async with aiohttp.ClientSession(trust_env=True, timeout=timeout) as session:
-            pending = {
-                asyncio.create_task(
-                    self.execute(session, req_start, node, initial_inputs, runtime_graph, llm_parameters, **kwargs)
-                )
-                for node in self.ind_nodes()
-            }
-            ind_nodes = self.ind_nodes()
+        # same for all nodes, so serialized only once per request
+        llm_parameters_dict = llm_parameters.model_dump()
+        session = get_shared_session()
+        ind_nodes = self.ind_nodes()
+
+        def execute_node(node, inputs):
+            return self.execute(
+                session,
+                req_start,
+                node,
+                inputs,
+                runtime_graph,
+                llm_parameters,
+                # a copy per node, so that align_inputs/align_outputs overrides changing it do not affect other nodes
+                llm_parameters_dict=dict(llm_parameters_dict),
+                **kwargs,
+            )
 
+        if sys.version_info >= (3, 11):
+
+            async def run_node(node, inputs):
+                response, node = await execute_node(node, inputs)
+                for d_node, d_inputs in self._on_node_done(
+                    node, response, result_dict, runtime_graph, predecessors, llm_parameters
+                ):
+                    task_group.create_task(run_node(d_node, d_inputs))
+
+            try:
+                async with asyncio.TaskGroup() as task_group:
+                    for node in ind_nodes:
+                        task_group.create_task(run_node(node, initial_inputs))
+            except ExceptionGroup as eg:  # noqa: F821, builtin since Python 3.11
+                # raise the first failing node's own exception rather than the group wrapping it,
+                # chained to the group so that the other nodes' failures still show in the traceback
+                raise eg.exceptions[0] from eg
+        else:
+            pending = {asyncio.create_task(execute_node(node, initial_inputs)) for node in ind_nodes}
             while pending:
                 done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
                 for done_task in done:
                     response, node = await done_task
-                    result_dict[node] = response
-
-                    # traverse the current node's downstream nodes and execute if all one's predecessors are finished
-                    downstreams = runtime_graph.downstream(node)
+                    for d_node, d_inputs in self._on_node_done(
+                        node, response, result_dict, runtime_graph, predecessors, llm_parameters
+                    ):
+                        pending.add(asyncio.create_task(execute_node(d_node, d_inputs)))
 
-                    # remove all the black nodes that are skipped to be forwarded to
-                    if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
-                        for black_node in response["downstream_black_list"]:
-                            for downstream in reversed(downstreams):
-                                try:
-                                    if re.findall(black_node, downstream):
-                                        if LOGFLAG:
-                                            logger.info(f"skip forwardding to {downstream}...")
-                                        runtime_graph.delete_edge(node, downstream)
-                                        downstreams.remove(downstream)
-                                except re.error as e:
-                                    logger.error("Pattern invalid! Operation cancelled.")
-                            if len(downstreams) == 0 and llm_parameters.stream:
-                                # turn the response to a StreamingResponse
-                                # to make the response uniform to UI
-                                def fake_stream(text):
-                                    yield "data: b'" + text + "'\n\n"
-                                    yield "data: [DONE]\n\n"
-
-                                result_dict[node] = StreamingResponse(
-                                    fake_stream(response["text"]), media_type="text/event-stream"
-                                )
-
-                    for d_node in downstreams:
-                        if all(i in result_dict for i in runtime_graph.predecessors(d_node)):
-                            inputs = self.process_outputs(runtime_graph.predecessors(d_node), result_dict)
-                            pending.add(
-                                asyncio.create_task(
-                                    self.execute(
-                                        session, req_start, d_node, inputs, runtime_graph, llm_parameters, **kwargs
-                                    )
-                                )
-                            )
         nodes_to_keep = []
         for i in ind_nodes:
             nodes_to_keep.append(i)
@@ -203,6 +335,53 @@ class ServiceOrchestrator(DAG):
 
         return result_dict, runtime_graph
 
+    def _on_node_done(
+        self,
+        node: str,
+        response,
+        result_dict: Dict,
+        runtime_graph: DAG,
+        predecessors: Dict[str, List[str]],
+        llm_parameters: LLMParams,
+    ) -> List:
+        """Record the node's response and return the (node, inputs) of the downstreams ready to run."""
+        result_dict[node] = response
+
+        # traverse the current node's downstream nodes and execute if all one's predecessors are finished
+        downstreams = runtime_graph.downstream(node)
+
+        # remove all the black nodes that are skipped to be forwarded to
+        if not isinstance(response, StreamingResponse) and "downstream_black_list" in response:
+            black_list = response["downstream_black_list"]
+            matchers = []
+            for black_node in black_list:
+                try:
+                    matchers.append(_black_list_matcher(black_node))
+                except re.error as e:
+                    logger.error("Pattern invalid! Operation cancelled.")
+            to_remove = {d for d in downstreams if any(is_black(d) for is_black in matchers)}
+            for downstream in to_remove:
+                if LOGFLAG:
+                    logger.info(f"skip forwardding to {downstream}...")
+                runtime_graph.delete_edge(node, downstream)
+                predecessors[downstream].remove(node)
+            if to_remove:
+                downstreams = [d for d in downstreams if d not in to_remove]
+            if black_list and len(downstreams) == 0 and llm_parameters.stream:
+                # turn the response to a StreamingResponse
+                # to make the response uniform to UI
+                def fake_stream(text):
+                    yield _SSE_PREFIX + b"b'" + text.encode("utf-8") + b"'" + _SSE_SUFFIX
+                    yield _SSE_DONE
+
+                result_dict[node] = StreamingResponse(fake_stream(response["text"]), media_type="text/event-stream")
+
+        ready = []
+        for d_node in downstreams:
+            if all(i in result_dict for i in predecessors[d_node]):
+                ready.append((d_node, self.process_outputs(predecessors[d_node], result_dict)))
+        return ready
+
     def process_outputs(self, prev_nodes: List, result_dict: Dict) -> Dict:
         all_outputs = {}
 
@@ -211,7 +390,7 @@ class ServiceOrchestrator(DAG):
             all_outputs.update(result_dict[prev_node])
         return all_outputs
 
-    def wrap_iterable(self, iterable, is_first=True):
+    async def wrap_iterable(self, aiterable, is_first=True):
 
         with tracer.start_as_current_span("llm_generate_stream") if ENABLE_OPEA_TELEMETRY else contextlib.nullcontext():
             while True:
@@ -221,10 +400,10 @@ class ServiceOrchestrator(DAG):
                     else contextlib.nullcontext()
                 ):  #  else tracer.start_as_current_span(f"llm_generate_stream_next_token")
                     try:
-                        token = next(iterable)
+                        token = await anext(aiterable)
                         yield token
                         is_first = False
-                    except StopIteration:
+                    except StopAsyncIteration:
                         # Exiting the iterable loop cleanly
                         break
                     except Exception as e:
@@ -239,18 +418,19 @@ class ServiceOrchestrator(DAG):
         inputs: Dict,
         runtime_graph: DAG,
         llm_parameters: LLMParams = LLMParams(),
+        llm_parameters_dict: Dict = None,
         **kwargs,
     ):
         # send the cur_node request/reply
 
-        llm_parameters_dict = llm_parameters.dict()
+        if llm_parameters_dict is None:
+            llm_parameters_dict = llm_parameters.model_dump()
 
         is_llm_vlm = self.services[cur_node].service_type in (ServiceType.LLM, ServiceType.LVM)
 
         if is_llm_vlm:
-            for field, value in llm_parameters_dict.items():
-                if inputs.get(field) != value:
-                    inputs[field] = value
+            # LLM parameters take precedence over the upstream outputs
+            inputs.update(llm_parameters_dict)
         # pre-process
         inputs = self.align_inputs(inputs, cur_node, runtime_graph, llm_parameters_dict, **kwargs)
         access_token = self.services[cur_node].api_key_value
@@ -258,8 +438,10 @@ class ServiceOrchestrator(DAG):
             endpoint = self.services[cur_node].endpoint_path(inputs["model"])
         else:
             endpoint = self.services[cur_node].endpoint_path(None)
+        headers = {"Content-type": "application/json"}
+        if access_token:
+            headers["Authorization"] = f"Bearer {access_token}"
         if is_llm_vlm and llm_parameters.stream:
-            # Still leave to sync requests.post for StreamingResponse
             if LOGFLAG:
                 logger.info(inputs)
             with (
@@ -267,87 +449,94 @@ class ServiceOrchestrator(DAG):
                 if ENABLE_OPEA_TELEMETRY
                 else contextlib.nullcontext()
             ):
-                if access_token:
-                    response = requests.post(
-                        url=endpoint,
-                        data=json.dumps(inputs),
-                        headers={"Content-type": "application/json", "Authorization": f"Bearer {access_token}"},
-                        proxies={"http": None},
-                        stream=True,
-                        timeout=2000,
-                    )
-
-                else:
-                    response = requests.post(
-                        url=endpoint,
-                        data=json.dumps(inputs),
-                        headers={
-                            "Content-type": "application/json",
-                        },
-                        proxies={"http": None},
-                        stream=True,
-                        timeout=2000,
-                    )
+                response = await session.post(
+                    endpoint, data=orjson.dumps(inputs, option=_JSON_OPTIONS), headers=headers
+                )
 
             downstream = runtime_graph.downstream(cur_node)
             if downstream:
                 assert len(downstream) == 1, "Not supported multiple stream downstreams yet!"
                 cur_node = downstream[0]
-                hitted_ends = [".", "?", "!", "。", "，", "！"]
                 downstream_endpoint = self.services[downstream[0]].endpoint_path()
 
-            def generate():
-                token_start = req_start
-                if response:
-                    # response.elapsed = time until first headers received
-                    buffered_chunk_str = ""
-                    is_first = True
-                    for chunk in self.wrap_iterable(response.iter_content(chunk_size=None)):
+            async def post_process(text):
+                res = await session.post(downstream_endpoint, data=orjson.dumps({"text": text}), headers=headers)
+                res_json = await res.json(loads=orjson.loads)
+                if "text" in res_json:
+                    return res_json["text"]
+                raise Exception("Other response types not supported yet!")
+
+            async def split_sentences(queue):
+                # send each finished sentence downstream while the next one is still streaming in,
+                # the queue keeps the post-process tasks in sentence order
+                buffered_chunk_str = ""
+                try:
+                    async for chunk in self.wrap_iterable(_iter_http_chunks(response)):
                         if chunk:
-                            if downstream:
-                                chunk = chunk.decode("utf-8")
-                                buffered_chunk_str += self.extract_chunk_str(chunk)
-                                is_last = chunk.endswith("[DONE]\n\n")
-                                if (buffered_chunk_str and buffered_chunk_str[-1] in hitted_ends) or is_last:
-                                    if access_token:
-                                        res = requests.post(
-                                            url=downstream_endpoint,
-                                            data=json.dumps({"text": buffered_chunk_str}),
-                                            headers={
-                                                "Content-type": "application/json",
-                                                "Authorization": f"Bearer {access_token}",
-                                            },
-                                            proxies={"http": None},
-                                            timeout=2000,
-                                        )
-                                    else:
-                                        res = requests.post(
-                                            url=downstream_endpoint,
-                                            data=json.dumps({"text": buffered_chunk_str}),
-                                            headers={
-                                                "Content-type": "application/json",
-                                            },
-                                            proxies={"http": None},
-                                            timeout=2000,
-                                        )
-                                    res_json = res.json()
-                                    if "text" in res_json:
-                                        res_txt = res_json["text"]
-                                    else:
-                                        raise Exception("Other response types not supported yet!")
-                                    buffered_chunk_str = ""  # clear
-                                    yield from self.token_generator(
+                            is_last = chunk.endswith(_STREAM_DONE)
+                            buffered_chunk_str += self.extract_chunk_str(chunk.decode("utf-8"))
+                            if buffered_chunk_str.endswith(_SENTENCE_ENDS) or is_last:
+                                post_task = asyncio.create_task(post_process(buffered_chunk_str))
+                                try:
+                                    await queue.put((post_task, is_last))
+                                except asyncio.CancelledError:
+                                    # not queued yet, so the consumer cannot cancel it
+                                    post_task.cancel()
+                                    raise
+                                buffered_chunk_str = ""  # clear
+                finally:
+                    await queue.put(None)
+
+            async def generate():
+                token_start = req_start
+                try:
+                    if response.ok:
+                        is_first = True
+                        if downstream:
+                            queue = asyncio.Queue(maxsize=STREAM_POST_PROCESS_CONCURRENCY)
+                            producer = asyncio.create_task(split_sentences(queue))
+                            try:
+                                while (item := await queue.get()) is not None:
+                                    post_task, is_last = item
+                                    res_txt = await post_task
+                                    for token in self.token_generator(
                                         res_txt, token_start, is_first=is_first, is_last=is_last
-                                    )
+                                    ):
+                                        yield token
                                     token_start = time.monotonic()
                                     is_first = False
-                            else:
-                                token_start = self.metrics.token_update(token_start, is_first)
-                                is_first = False
-                                yield chunk
-
-                    self.metrics.request_update(req_start)
-                    self.metrics.pending_update(False)
+                                await producer
+                            finally:
+                                producer.cancel()
+                                while not queue.empty():
+                                    item = queue.get_nowait()
+                                    if item is not None:
+                                        item[0].cancel()
+                                await asyncio.gather(producer, return_exceptions=True)
+                        else:
+                            latencies = []
+                            try:
+                                async for chunk in self.wrap_iterable(_iter_http_chunks(response)):
+                                    if chunk:
+                                        if is_first:
+                                            token_start = self.metrics.token_update(token_start, is_first)
+                                            is_first = False
+                                        else:
+                                            now = time.monotonic()
+                                            latencies.append(now - token_start)
+                                            token_start = now
+                                            if len(latencies) >= TOKEN_METRICS_BATCH_SIZE:
+                                                self.metrics.inter_token_update(latencies)
+                                                latencies = []
+                                        yield chunk
+                            finally:
+                                if latencies:
+                                    self.metrics.inter_token_update(latencies)
+
+                        self.metrics.request_update(req_start)
+                        self.metrics.pending_update(False)
+                finally:
+                    response.release()
 
             return (
                 StreamingResponse(self.align_generator(generate(), **kwargs), media_type="text/event-stream"),
@@ -363,28 +552,53 @@ class ServiceOrchestrator(DAG):
             else:
                 input_data = inputs
 
-            with (
-                tracer.start_as_current_span(f"{cur_node}_generate")
-                if ENABLE_OPEA_TELEMETRY
-                else contextlib.nullcontext()
-            ):
-                response = await session.post(
-                    endpoint,
-                    json=input_data,
-                    headers={"Content-type": "application/json", "Authorization": f"Bearer {access_token}"},
-                )
-
-            if response.content_type == "audio/wav":
-                audio_data = await response.read()
-                data = self.align_outputs(audio_data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+            cache_key = self._result_cache_key(cur_node, input_data)
+            if cache_key in self._result_cache:
+                self._result_cache.move_to_end(cache_key)
+                data = copy.deepcopy(self._result_cache[cache_key])
             else:
-                # Parse as JSON
-                data = await response.json()
-                # post process
-                data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
+                with (
+                    tracer.start_as_current_span(f"{cur_node}_generate")
+                    if ENABLE_OPEA_TELEMETRY
+                    else contextlib.nullcontext()
+                ):
+                    response = await session.post(
+                        endpoint,
+                        data=orjson.dumps(input_data, option=_JSON_OPTIONS),
+                        headers=headers,
+                    )
+
+                if response.content_type == "audio/wav":
+                    data = await response.read()
+                else:
+                    # Parse as JSON
+                    data = await response.json(loads=orjson.loads)
+                    if response.ok:
+                        self._cache_result(cache_key, data)
+
+            # post process
+            data = self.align_outputs(data, cur_node, inputs, runtime_graph, llm_parameters_dict, **kwargs)
 
             return data, cur_node
 
+    def _result_cache_key(self, cur_node: str, input_data: Dict):
+        if not self.result_cache_size:
+            return None
+        try:
+            return cur_node, orjson.dumps(input_data, option=_JSON_OPTIONS | orjson.OPT_SORT_KEYS)
+        except TypeError:
+            # not JSON serializable, so not cacheable
+            return None
+
+    def _cache_result(self, cache_key, data) -> None:
+        if cache_key is None:
+            return
+        # keep a private copy, align_outputs() may modify the returned data in place
+        self._result_cache[cache_key] = copy.deepcopy(data)
+        self._result_cache.move_to_end(cache_key)
+        while len(self._result_cache) > self.result_cache_size:
+            self._result_cache.popitem(last=False)
+
     def align_inputs(self, inputs, *args, **kwargs):
         """Override this method in megaservice definition."""
         return inputs
@@ -394,7 +608,10 @@ class ServiceOrchestrator(DAG):
         return data
 
     def align_generator(self, gen, *args, **kwargs):
-        """Override this method in megaservice definition."""
+        """Override this method in megaservice definition.
+
+        Note that `gen` is an async generator yielding the raw stream chunks.
+        """
         return gen
 
     def get_all_final_outputs(self, result_dict, runtime_graph):
@@ -406,23 +623,30 @@ class ServiceOrchestrator(DAG):
     def extract_chunk_str(self, chunk_str):
         if chunk_str == "data: [DONE]\n\n":
             return ""
-        prefix = "data: b'"
-        prefix_2 = 'data: b"'
-        suffix = "'\n\n"
-        suffix_2 = '"\n\n'
-        if chunk_str.startswith(prefix) or chunk_str.startswith(prefix_2):
-            chunk_str = chunk_str[len(prefix) :]
-        if chunk_str.endswith(suffix) or chunk_str.endswith(suffix_2):
-            chunk_str = chunk_str[: -len(suffix)]
+        if chunk_str.startswith(_CHUNK_PREFIXES):
+            chunk_str = chunk_str[_CHUNK_PREFIX_LEN:]
+        if chunk_str.endswith(_CHUNK_SUFFIXES):
+            chunk_str = chunk_str[:-_CHUNK_SUFFIX_LEN]
         return chunk_str
 
-    def token_generator(self, sentence: str, token_start: float, is_first: bool, is_last: bool) -> str:
-        prefix = "data: "
-        suffix = "\n\n"
-        tokens = re.findall(r"\s?\S+\s?", sentence, re.UNICODE)
-        for token in tokens:
-            token_start = self.metrics.token_update(token_start, is_first)
-            yield prefix + repr(token.replace("\\n", "\n").encode("utf-8")) + suffix
-            is_first = False
+    def token_generator(self, sentence: str, token_start: float, is_first: bool, is_last: bool) -> bytes:
+        monotonic = time.monotonic
+        # inter-token latencies are recorded once the sentence is done
+        latencies = []
+        try:
+            for match in _TOKEN_RE.finditer(sentence):
+                if is_first:
+                    token_start = self.metrics.token_update(token_start, is_first)
+                    is_first = False
+                else:
+                    now = monotonic()
+                    latencies.append(now - token_start)
+                    token_start = now
+                # the repr of the token bytes is pure ASCII
+                token = repr(match.group().replace("\\n", "\n").encode("utf-8")).encode("ascii")
+                yield _SSE_PREFIX + token + _SSE_SUFFIX
+        finally:
+            if latencies:
+                self.metrics.inter_token_update(latencies)
         if is_last:
-            yield "data: [DONE]\n\n"
+            yield _SSE_DONE
@@ -2,10 +2,17 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import asyncio
+import functools
+import hashlib
+import json
 import os
+import re
+import time
+from collections import OrderedDict
+from types import MappingProxyType
 from typing import Union
 
-from langchain_community.utilities.requests import JsonRequestsWrapper
+import httpx
 from langchain_openai import ChatOpenAI
 
 from comps import CustomLogger, GeneratedDoc, OpeaComponent, OpeaComponentRegistry, ServiceType, TextDoc
@@ -16,33 +23,117 @@ logflag = os.getenv("LOGFLAG", False)
 
 DEFAULT_MODEL = "meta-llama/LlamaGuard-7b"
 
+# HTTP clients shared by all requests to the safety guard endpoint, so that connections are kept alive and reused
+_http_limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+http_client = httpx.Client(limits=_http_limits, timeout=httpx.Timeout(60.0))
+http_async_client = httpx.AsyncClient(limits=_http_limits, timeout=httpx.Timeout(60.0))
+
+
+async def aclose_http_clients():
+    """Close the shared HTTP clients, to be called on service shutdown."""
+    http_client.close()
+    await http_async_client.aclose()
+
+
+LLAMA_GUARD_7B_UNSAFE_DICT = MappingProxyType(
+    {
+        "O1": "Violence and Hate",
+        "O2": "Sexual Content",
+        "O3": "Criminal Planning",
+        "O4": "Guns and Illegal Weapons",
+        "O5": "Regulated or Controlled Substances",
+        "O6": "Self-Harm",
+    }
+)
+
+# Standard MLCommons taxonomy of hazard
+# https://mlcommons.org/2024/04/mlc-aisafety-v0-5-poc/
+MLCOMMONS_UNSAFE_DICT = MappingProxyType(
+    {
+        "S1": "Violent Crimes",
+        "S2": "Non-Violent Crimes",
+        "S3": "Sex Crimes",
+        "S4": "Child Exploitation",
+        "S5": "Specialized Advice",
+        "S6": "Privacy",
+        "S7": "Intellectual Property",
+        "S8": "Indiscriminate Weapons",
+        "S9": "Hate",
+        "S10": "Self-Harm",
+        "S11": "Sexual Content",
+    }
+)
+
+# "unsafe" verdict, followed by the violated category code on the next line
+_UNSAFE_RE = re.compile(r"unsafe(?:\s*\n\s*(\w+))?")
+
+
+class VerdictCache:
+    """In-process LRU cache of guard model verdicts, with a TTL so that a reloaded model is picked up.
+
+    Concurrent lookups of the same uncached key share a single call to the guard model.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expiry time, verdict), in LRU order
+        self._inflight = {}  # key -> task computing the verdict
+
+    @staticmethod
+    def make_key(messages) -> str:
+        canonical = json.dumps(messages, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expiry, verdict = entry
+        if expiry < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return verdict
+
+    def put(self, key, verdict) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, verdict)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key, compute):
+        verdict = self.get(key)
+        if verdict is not None:
+            return verdict
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_computed(key, t))
+        # shielded, so that a cancelled request does not cancel the call shared with other requests
+        return await asyncio.shield(task)
+
+    def _on_computed(self, key, task) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
 
 def get_unsafe_dict(model_id=DEFAULT_MODEL):
     if model_id == "meta-llama/LlamaGuard-7b":
-        return {
-            "O1": "Violence and Hate",
-            "O2": "Sexual Content",
-            "O3": "Criminal Planning",
-            "O4": "Guns and Illegal Weapons",
-            "O5": "Regulated or Controlled Substances",
-            "O6": "Self-Harm",
-        }
+        return LLAMA_GUARD_7B_UNSAFE_DICT
     else:
-        # Standard MLCommons taxonomy of hazard
-        # https://mlcommons.org/2024/04/mlc-aisafety-v0-5-poc/
-        return {
-            "S1": "Violent Crimes",
-            "S2": "Non-Violent Crimes",
-            "S3": "Sex Crimes",
-            "S4": "Child Exploitation",
-            "S5": "Specialized Advice",
-            "S6": "Privacy",
-            "S7": "Intellectual Property",
-            "S8": "Indiscriminate Weapons",
-            "S9": "Hate",
-            "S10": "Self-Harm",
-            "S11": "Sexual Content",
-        }
+        return MLCOMMONS_UNSAFE_DICT
+
+
+@functools.lru_cache(maxsize=None)
+def _fetch_service_model_id(endpoint_url):
+    # failures raise and are therefore not cached
+    model_info = http_client.get(f"{endpoint_url.rstrip('/')}/v1/models").json()
+    if not model_info.get("data"):
+        raise LookupError(f"No models are served at {endpoint_url}")
+    return model_info["data"][0]["id"]
 
 
 def get_service_model_id(endpoint_url, default=DEFAULT_MODEL):
@@ -51,11 +142,10 @@ def get_service_model_id(endpoint_url, default=DEFAULT_MODEL):
     Falls back to default if the request fails or no models are returned.
     """
     try:
-        requests = JsonRequestsWrapper()
-        models_endpoint = os.path.join(endpoint_url.rstrip("/"), "v1/models")
-        model_info = requests.get(models_endpoint)
-        if "data" in model_info and len(model_info["data"]) > 0:
-            return model_info["data"][0]["id"]
+        return _fetch_service_model_id(endpoint_url)
+    except LookupError:
+        # no models listed, the documented default applies
+        pass
     except Exception as e:
         logger.error(f"Get model id failed due to an exception: {e}")
     return default
@@ -68,14 +158,20 @@ class OpeaGuardrailsLlamaGuard(OpeaComponent):
     def __init__(self, name: str, description: str, config: dict = None):
         super().__init__(name, ServiceType.GUARDRAIL.name.lower(), description, config)
         safety_guard_endpoint = os.getenv("SAFETY_GUARD_ENDPOINT", "http://localhost:8080")
-        safety_guard_model = os.getenv("SAFETY_GUARD_MODEL_ID", get_service_model_id(safety_guard_endpoint))
+        safety_guard_model = os.getenv("SAFETY_GUARD_MODEL_ID") or get_service_model_id(safety_guard_endpoint)
         self.model_name = safety_guard_model
 
         # Create a ChatOpenAI object
         self.llm_engine_hf = ChatOpenAI(
             model=safety_guard_model,  # Model ID for OpenAI-compatible format
             openai_api_key="empty",  # Optional, use if necessary
-            openai_api_base=os.path.join(safety_guard_endpoint.rstrip("/"), "v1"),
+            openai_api_base=f"{safety_guard_endpoint.rstrip('/')}/v1",
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+        cache_size = int(os.getenv("SAFETY_GUARD_CACHE_SIZE", 1024))
+        self.verdict_cache = (
+            VerdictCache(cache_size, float(os.getenv("SAFETY_GUARD_CACHE_TTL", 300))) if cache_size > 0 else None
         )
         health_status = self.check_health()
         if not health_status:
@@ -104,13 +200,18 @@ class OpeaGuardrailsLlamaGuard(OpeaComponent):
             messages = [{"role": "user", "content": input.prompt}, {"role": "assistant", "content": input.text}]
         else:
             messages = [{"role": "user", "content": input.text}]
-        response = await asyncio.to_thread(self.llm_engine_hf.invoke, messages)
-        response_input_guard = response.content
+        if self.verdict_cache is None:
+            response_input_guard = await self._get_verdict(messages)
+        else:
+            response_input_guard = await self.verdict_cache.get_or_compute(
+                VerdictCache.make_key(messages), lambda: self._get_verdict(messages)
+            )
 
-        if "unsafe" in response_input_guard:
+        unsafe_match = _UNSAFE_RE.search(response_input_guard)
+        if unsafe_match:
             unsafe_dict = get_unsafe_dict(self.model_name)
-            policy_violation_level = response_input_guard.split("\n")[1].strip()
-            policy_violations = unsafe_dict[policy_violation_level]
+            policy_violation_level = unsafe_match.group(1)
+            policy_violations = unsafe_dict.get(policy_violation_level, policy_violation_level or "unknown")
             if logflag:
                 logger.info(f"Violated policies: {policy_violations}")
             res = TextDoc(
@@ -122,12 +223,17 @@ class OpeaGuardrailsLlamaGuard(OpeaComponent):
             logger.info(res)
         return res
 
+    async def _get_verdict(self, messages) -> str:
+        response = await self.llm_engine_hf.ainvoke(messages)
+        return response.content
+
     def check_health(self) -> bool:
         """Checks the health of the Llama Guard service.
 
         This function verifies if the Llama Guard service is operational by
         sending a guardrails check request to the LLM engine. It evaluates the
-        service's response to determine its health.
+        service's response to determine its health. It is only called from
+        `__init__`, before any request is served, so it uses the blocking client.
 
         Returns:
             bool:
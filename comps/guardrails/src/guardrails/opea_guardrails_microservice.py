@@ -9,7 +9,7 @@ from typing import Union
 from dotenv import dotenv_values
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
-from integrations.llamaguard import OpeaGuardrailsLlamaGuard
+from integrations.llamaguard import OpeaGuardrailsLlamaGuard, aclose_http_clients
 from integrations.wildguard import OpeaGuardrailsWildGuard
 from pydantic import ValidationError
 from utils.llm_guard_input_guardrail import OPEALLMGuardInputGuardrail
@@ -94,6 +94,9 @@ async def safety_guard(input: Union[LLMParamsDoc, GeneratedDoc, TextDoc]) -> Uni
         raise
 
 
+opea_microservices["opea_service@guardrails"].app.add_event_handler("shutdown", aclose_http_clients)
+
+
 if __name__ == "__main__":
     opea_microservices["opea_service@guardrails"].start()
     logger.info("OPEA guardrails Microservice is up and running successfully...")
@@ -19,6 +19,7 @@ import time
 import unittest
 
 from comps import ServiceOrchestrator, TextDoc, opea_microservices, register_microservice
+from comps.cores.mega.orchestrator import close_shared_session
 
 
 @register_microservice(name="s1", host="0.0.0.0", port=8083, endpoint="/v1/add")
@@ -80,6 +81,9 @@ class TestServiceOrchestrator(unittest.IsolatedAsyncioTestCase):
         self.process2.terminate()
         self.process3.terminate()
 
+    async def asyncTearDown(self):
+        await close_shared_session()
+
     async def test_schedule(self):
         t = time.monotonic()
         task1 = asyncio.create_task(self.service_builder.schedule(initial_inputs={"text": "hello, "}))
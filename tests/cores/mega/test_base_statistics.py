@@ -18,6 +18,7 @@ from comps import (
     statistics_dict,
 )
 from comps.cores.mega.base_statistics import collect_all_statistics
+from comps.cores.mega.orchestrator import close_shared_session
 
 SVC1 = "opea_service@s1_add"
 SVC2 = "open_service@test"
@@ -50,6 +51,9 @@ class TestBaseStatistics(unittest.IsolatedAsyncioTestCase):
         self.s1.stop()
         self.process1.terminate()
 
+    async def asyncTearDown(self):
+        await close_shared_session()
+
     async def test_base_statistics(self):
         for _ in range(2):
             task1 = asyncio.create_task(self.service_builder.schedule(initial_inputs={"text": "hello, "}))
@@ -7,6 +7,7 @@ import unittest
 from fastapi.testclient import TestClient
 
 from comps import ServiceOrchestrator, TextDoc, opea_microservices, register_microservice
+from comps.cores.mega.orchestrator import close_shared_session
 
 
 @register_microservice(name="s1", host="0.0.0.0", port=8080, endpoint="/v1/add")
@@ -81,6 +82,9 @@ class TestMicroService(unittest.IsolatedAsyncioTestCase):
         self.process3.terminate()
         self.process4.terminate()
 
+    async def asyncTearDown(self):
+        await close_shared_session()
+
     async def test_add_route(self):
         result_dict, runtime_graph = await self.service_builder.schedule(initial_inputs={"text": "Hi!"})
         assert len(result_dict) == 4
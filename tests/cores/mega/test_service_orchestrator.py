@@ -4,8 +4,12 @@
 import json
 import multiprocessing
 import unittest
+from unittest import mock
+
+import aiohttp
 
 from comps import ServiceOrchestrator, TextDoc, opea_microservices, register_microservice
+from comps.cores.mega.orchestrator import close_shared_session
 
 
 @register_microservice(name="s1", host="0.0.0.0", port=8083, endpoint="/v1/add")
@@ -48,10 +52,27 @@ class TestServiceOrchestrator(unittest.IsolatedAsyncioTestCase):
         cls.process1.terminate()
         cls.process2.terminate()
 
+    async def asyncTearDown(self):
+        await close_shared_session()
+
     async def test_schedule(self):
         result_dict, _ = await self.service_builder.schedule(initial_inputs={"text": "hello, "})
         self.assertEqual(result_dict[self.s2.name]["text"], "hello, opea project!")
 
+    async def test_schedule_with_result_cache(self):
+        service_builder = ServiceOrchestrator(result_cache_size=2)
+        service_builder.add(self.s1).add(self.s2)
+        service_builder.flow_to(self.s1, self.s2)
+
+        post = aiohttp.ClientSession.post
+        with mock.patch.object(aiohttp.ClientSession, "post", autospec=True, side_effect=post) as mock_post:
+            for _ in range(2):
+                result_dict, _ = await service_builder.schedule(initial_inputs={"text": "hello, "})
+                self.assertEqual(result_dict[self.s2.name]["text"], "hello, opea project!")
+                # the second run is answered from the cache without calling the micro services
+                self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual([node for node, _ in service_builder._result_cache], [self.s1.name, self.s2.name])
+
 
 if __name__ == "__main__":
     unittest.main()
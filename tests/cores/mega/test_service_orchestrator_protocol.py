@@ -5,6 +5,7 @@ import multiprocessing
 import unittest
 
 from comps import ServiceOrchestrator, opea_microservices, register_microservice
+from comps.cores.mega.orchestrator import close_shared_session
 from comps.cores.proto.api_protocol import ChatCompletionRequest
 
 
@@ -28,6 +29,9 @@ class TestServiceOrchestratorProtocol(unittest.IsolatedAsyncioTestCase):
         self.s1.stop()
         self.process1.terminate()
 
+    async def asyncTearDown(self):
+        await close_shared_session()
+
     async def test_schedule(self):
         input_data = ChatCompletionRequest(messages=[{"role": "user", "content": "What's up man?"}], seed=None)
         result_dict, _ = await self.service_builder.schedule(initial_inputs=input_data)
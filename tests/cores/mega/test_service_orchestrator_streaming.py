@@ -1,6 +1,7 @@
 # Copyright (C) 2024 Intel Corporation
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 import json
 import multiprocessing
 import time
@@ -11,6 +12,7 @@ from fastapi.responses import StreamingResponse
 from prometheus_client import start_http_server
 
 from comps import ServiceOrchestrator, ServiceType, TextDoc, opea_microservices, register_microservice
+from comps.cores.mega.orchestrator import close_shared_session
 
 _METRIC_PORT = 8000
 
@@ -20,6 +22,9 @@ async def s1_add(request: TextDoc) -> TextDoc:
     req = request.model_dump_json()
     req_dict = json.loads(req)
     text = req_dict["text"]
+    if "OPEA" in text:
+        # the first sentence is post-processed slowest, its reply must still be streamed first
+        await asyncio.sleep(0.5)
     text += " ~~~"
     return {"text": text}
 
@@ -66,13 +71,16 @@ class TestServiceOrchestratorStreaming(unittest.IsolatedAsyncioTestCase):
         cls.server.shutdown()
         cls.thread.join()
 
+    async def asyncTearDown(self):
+        await close_shared_session()
+
     async def test_schedule(self):
         result_dict, _ = await self.service_builder.schedule(initial_inputs={"text": "hello, "})
         response = result_dict["s1/MicroService"]
         idx = 0
         res_expected = ["OPEA", "is", "great.", "~~~", "I", "think", "so.", "~~~"]
         async for k in response.__reduce__()[2]["body_iterator"]:
-            self.assertEqual(self.service_builder.extract_chunk_str(k).strip(), res_expected[idx])
+            self.assertEqual(self.service_builder.extract_chunk_str(k.decode("utf-8")).strip(), res_expected[idx])
             idx += 1
         token_count = len(res_expected)
         self.assertEqual(idx, token_count)
@@ -117,12 +125,12 @@ class TestServiceOrchestratorStreaming(unittest.IsolatedAsyncioTestCase):
         for i in self.service_builder.token_generator(
             sentence=sentence, token_start=start, is_first=True, is_last=False
         ):
-            self.assertTrue(i.startswith("data: b'"))
+            self.assertTrue(i.startswith(b"data: b'"))
 
         for i in self.service_builder.token_generator(
             sentence=sentence, token_start=start, is_first=False, is_last=True
         ):
-            self.assertTrue(i.startswith("data: "))
+            self.assertTrue(i.startswith(b"data: "))
 
 
 if __name__ == "__main__":
@@ -7,6 +7,7 @@ import unittest
 
 from comps import EmbedDoc, ServiceOrchestrator, TextDoc, opea_microservices, register_microservice
 from comps.cores.mega.constants import ServiceType
+from comps.cores.mega.orchestrator import close_shared_session
 from comps.cores.proto.docarray import RerankerParms, RetrieverParms
 
 
@@ -66,6 +67,9 @@ class TestServiceOrchestratorParams(unittest.IsolatedAsyncioTestCase):
         self.process1.terminate()
         self.process2.terminate()
 
+    async def asyncTearDown(self):
+        await close_shared_session()
+
     async def test_retriever_schedule(self):
         result_dict, _ = await self.service_builder.schedule(
             initial_inputs={"text": "hello, ", "embedding": [1.0, 2.0, 3.0]},